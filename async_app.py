@@ -0,0 +1,638 @@
+"""Async variant of the session API: /status, /session, /session/<job_id> and /session/heartbeat.
+
+Same request/response contract as app.py, but a provisioning is a coroutine on one event loop talking to
+docker through aiodocker and to the database through SQLAlchemy's async engine, so thousands of them can be
+in flight without a thread each. Models, configuration, placement, admission, caches and every background
+job (heartbeat flusher, idle reaper, pool, templates, ...) are the ones from app.py, run as they are there.
+
+    python async_app.py
+"""
+
+import asyncio
+import logging as log
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
+import aiodocker
+from aiohttp import web
+from sqlalchemy import delete, event, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import app as core
+
+#-------------------------------------
+# Configuration
+#-------------------------------------
+
+ASYNC_API_HOST = '0.0.0.0'
+ASYNC_API_PORT = 5001
+# Pending provisionings kept before /session answers 503. Each one is a coroutine, not a worker thread,
+# docker itself is still paced by admission control.
+ASYNC_PROVISIONING_QUEUE_LIMIT = 10000
+
+#---------------------------------------------
+# Async docker and database backends
+#---------------------------------------------
+
+class ContainerView:
+    """The docker-py Container attributes the helpers in app.py read, over an inspected aiodocker container."""
+
+    def __init__(self, container):
+        self.attrs = {key: container[key] for key in ('Id', 'Name', 'State', 'Config', 'NetworkSettings', 'Mounts')}
+
+    @property
+    def id(self):
+        return self.attrs['Id']
+
+    @property
+    def name(self):
+        return self.attrs['Name'].lstrip('/')
+
+    @property
+    def status(self):
+        return self.attrs['State']['Status']
+
+    @property
+    def labels(self):
+        return self.attrs['Config'].get('Labels') or {}
+
+    @property
+    def ports(self):
+        return self.attrs['NetworkSettings'].get('Ports') or {}
+
+
+class AsyncNode:
+    def __init__(self, node, docker):
+        self.core = node
+        self.docker = docker
+        self.name = node.name
+
+
+def default_docker_client(name, options):
+    return aiodocker.Docker(url=options.get('base_url'))
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # app.py's listener only knows the sqlite3 module, aiosqlite hands over an adapted connection.
+    cursor = dbapi_connection.cursor()
+    for pragma, value in core.SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+
+class AsyncBackend:
+    """The async engine and one aiodocker client per node, opened on the API's event loop."""
+
+    def __init__(self):
+        self.engine = None
+        self.nodes = {}
+
+    async def start(self, docker_client=default_docker_client):
+        # Same database as app.py, with Flask-SQLAlchemy's resolution of relative SQLite paths.
+        with core.app.app_context():
+            url = core.db.engine.url
+        if url.get_backend_name() == 'postgresql':
+            self.engine = create_async_engine(url.set(drivername='postgresql+asyncpg'),
+                                              pool_size=core.DB_POOL_SIZE, max_overflow=core.DB_MAX_OVERFLOW,
+                                              pool_recycle=core.DB_POOL_RECYCLE_SECONDS, pool_pre_ping=True)
+        else:
+            self.engine = create_async_engine(url.set(drivername='sqlite+aiosqlite'),
+                                              pool_size=core.DB_POOL_SIZE, max_overflow=core.DB_MAX_OVERFLOW,
+                                              connect_args={'timeout': core.SQLITE_PRAGMAS['busy_timeout'] / 1000})
+            event.listen(self.engine.sync_engine, 'connect', set_sqlite_pragmas)
+
+        for name, node in core.SCHEDULER.nodes.items():
+            self.nodes[name] = AsyncNode(node, docker_client(name, core.DOCKER_NODES.get(name, {})))
+        log.info(f"Async backend started with {len(self.nodes)} docker nodes")
+
+    async def close(self):
+        for node in self.nodes.values():
+            await node.docker.close()
+        self.nodes = {}
+        if self.engine is not None:
+            await self.engine.dispose()
+
+    def insert(self, model):
+        if self.engine.dialect.name == 'postgresql':
+            return postgresql_insert(model)
+        return sqlite_insert(model)
+
+    async def node_for(self, userhash):
+        node = core.SCHEDULER.placement(userhash)
+        if node is None:
+            # A user this process hasn't placed yet is looked up on every node with the blocking client.
+            node = await asyncio.to_thread(core.SCHEDULER.node_for, userhash)
+        return self.nodes[node.name]
+
+
+BACKEND = AsyncBackend()
+
+#---------------------------------------------
+# Single-flight provisioning per userhash
+#---------------------------------------------
+
+class AsyncSingleFlight:
+    """Callers for the same key await the one in-flight provisioning, across processes through the DB lock."""
+
+    def __init__(self):
+        self.flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    @asynccontextmanager
+    async def db_lock(self, key):
+        # The same ProvisioningLock rows as app.py, so a Flask worker and this API never provision one user twice.
+        table = core.ProvisioningLock.__table__
+        owner = core.SESSION_FLIGHTS.owner
+        # Same owner as app.py's SingleFlight, so its refresher thread keeps these rows fresh too.
+        core.SESSION_FLIGHTS.ensure_refresher()
+        while True:
+            try:
+                async with BACKEND.engine.begin() as conn:
+                    await conn.execute(insert(table).values(userhash=key, owner=owner, acquired_at=datetime.now(timezone.utc)))
+                break
+            except IntegrityError:
+                cutoff = datetime.now(timezone.utc) - timedelta(seconds=core.PROVISIONING_LOCK_TTL_SECONDS)
+                async with BACKEND.engine.begin() as conn:
+                    await conn.execute(delete(table).where(table.c.userhash == key, table.c.acquired_at < cutoff))
+                await asyncio.sleep(core.PROVISIONING_LOCK_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            async with BACKEND.engine.begin() as conn:
+                await conn.execute(delete(table).where(table.c.userhash == key, table.c.owner == owner))
+
+    async def lead(self, key, fn):
+        if core.SINGLE_FLIGHT_DB_LOCK:
+            async with self.db_lock(key):
+                return await fn()
+        return await fn()
+
+    async def do(self, key, fn):
+        flight = self.flights.get(key)
+        if flight is None:
+            self.leaders += 1
+            flight = self.flights[key] = asyncio.ensure_future(self.lead(key, fn))
+            flight.add_done_callback(lambda _: self.flights.pop(key, None))
+        else:
+            self.coalesced += 1
+        # Shielded, so one caller going away doesn't cancel the provisioning the others wait on.
+        return await asyncio.shield(flight)
+
+    def stats(self):
+        return {"in_flight": len(self.flights), "leaders": self.leaders, "coalesced": self.coalesced}
+
+
+ASYNC_FLIGHTS = AsyncSingleFlight()
+
+#---------------------------------------------
+# Session provisioning
+#---------------------------------------------
+
+def session_container_config(node, userhash):
+    # What UserManager.run_session_container passes to docker-py, as the raw API body.
+    binds = [f"home_{userhash}:/home/{userhash}:rw"]
+    binds += [f"{source}:{spec['bind']}:{spec['mode']}" for source, spec in core.shared_volumes().items()]
+    config = {
+        "Image": core.DOCKER_IMAGE_NAME,
+        "WorkingDir": f"/home/{userhash}",
+        "Env": [f"HOME=/home/{userhash}"],
+        "Labels": core.container_labels('session', userhash),
+        "OpenStdin": True,
+        "Tty": True,
+        "HostConfig": {
+            "Binds": binds,
+            "Memory": core.SESSION_MEM_LIMIT_BYTES,
+            "NanoCpus": core.SESSION_NANO_CPUS,
+            "PidsLimit": core.SESSION_PIDS_LIMIT,
+        },
+    }
+    if node.core.uses_session_network():
+        config["HostConfig"]["NetworkMode"] = core.SESSION_NETWORK
+    else:
+        config["ExposedPorts"] = {core.PORT_BEING_USED: {}}
+        config["HostConfig"]["PortBindings"] = {core.PORT_BEING_USED: [{"HostPort": ""}]}
+    return config
+
+
+# Waiting for capacity blocks on the admission condition shared with app.py. It gets its own threads,
+# at most ADMISSION_MAX_WAITING of them wait at once anyway, so it never holds up the other to_thread work.
+ADMISSION_WAITERS = ThreadPoolExecutor(max_workers=core.ADMISSION_MAX_WAITING, thread_name_prefix='admission')
+
+
+async def admit(node, container_name):
+    if node.core.admission.try_acquire(container_name):
+        return
+    if node.core.admission.waiting >= core.ADMISSION_MAX_WAITING:
+        # Rejected right away rather than queued behind the waiters for a thread.
+        with node.core.admission.condition:
+            node.core.admission.rejected += 1
+        raise core.HostFull(core.ADMISSION_RETRY_AFTER_SECONDS)
+    await asyncio.get_running_loop().run_in_executor(ADMISSION_WAITERS, node.core.admission.acquire, container_name)
+
+
+def restore_cold_home(userhash):
+    # ColdStorage goes through Flask-SQLAlchemy's session, which needs an app context on the worker thread.
+    with core.app.app_context():
+        return core.COLD_STORAGE.ensure_restored(userhash)
+
+
+async def lookup_container(node, container_name):
+    try:
+        return await node.docker.containers.get(container_name)
+    except aiodocker.DockerError as e:
+        if e.status == 404:
+            return None
+        raise
+
+
+async def wake_container(node, container, userhash):
+    # Returns the path taken, 'existing', 'unpause' or 'start'.
+    status = container['State']['Status']
+    if status == 'paused':
+        log.info(f"Found paused container for {userhash}. Unpausing it....")
+        with core.METRICS.timed('unpause'):
+            await container.unpause()
+            await container.show()
+        return 'unpause'
+    if status != 'running':
+        view = ContainerView(container)
+        if not core.mounts_git_cache(view):
+            log.info(f"Replacing stopped container of {userhash}, it predates the git object cache")
+            await container.delete(force=True)
+            if view.labels.get('rootblood.slot'):
+                await asyncio.to_thread(core.WARM_POOL.release_slot, view)
+            raise aiodocker.DockerError(404, {"message": f"Removed {view.name}"})
+        log.info(f"Found stopped container for {userhash}. Starting it....")
+        container_name = f"rootblood_session_{userhash}"
+        with core.METRICS.timed('admission_wait'):
+            await admit(node, container_name)
+        try:
+            with core.METRICS.timed('start'):
+                if view.labels.get('rootblood.slot'):
+                    await asyncio.to_thread(core.WARM_POOL.bind_home, view, userhash)
+                await container.start()
+                await container.show()
+        except Exception:
+            node.core.admission.release(container_name)
+            raise
+        return 'start'
+    log.info(f"Container for {userhash} is already running....")
+    return 'existing'
+
+
+async def create_container(node, userhash):
+    container_name = f"rootblood_session_{userhash}"
+    log.info(f"No container found for {userhash}. Creating a new one on {node.name}...")
+    with core.METRICS.timed('admission_wait'):
+        await admit(node, container_name)
+    try:
+        with core.METRICS.timed('container_run'):
+            container = await node.docker.containers.run(session_container_config(node, userhash), name=container_name)
+            await container.show()
+            return container
+    except Exception:
+        node.core.admission.release(container_name)
+        raise
+
+
+async def find_or_create_container(userhash):
+    container_name = f"rootblood_session_{userhash}"
+    node = await BACKEND.node_for(userhash)
+    cache_token = core.SESSION_CACHE.token()
+
+    with core.METRICS.timed('container_lookup'):
+        container = await lookup_container(node, container_name)
+    if container is not None:
+        try:
+            path = await wake_container(node, container, userhash)
+        except aiodocker.DockerError as e:
+            # Removed between the lookup and the start, by the idle reaper for instance.
+            if e.status != 404:
+                raise
+            container = None
+
+    if container is None:
+        # The filesystem work of restoring and cloning homes stays blocking, on threads, and only on this path.
+        if core.COLD_STORAGE_ENABLED:
+            with core.METRICS.timed('cold_restore'):
+                restored = await asyncio.to_thread(restore_cold_home, userhash)
+            node = BACKEND.nodes[restored.name] if restored is not None else node
+        if core.HOME_TEMPLATES_ENABLED and node.core.local:
+            with core.METRICS.timed('home_provision'):
+                await asyncio.to_thread(core.HOME_TEMPLATES.ensure_home, node.core, userhash)
+        # Otherwise the plain home_<userhash> volume is created by docker itself when the container is run.
+        path = 'pool'
+        if core.WARM_POOL_ENABLED and node.core is core.WARM_POOL.node:
+            with core.METRICS.timed('pool_claim'):
+                claimed = await asyncio.to_thread(core.WARM_POOL.claim, userhash)
+            if claimed is not None:
+                container = await node.docker.containers.get(claimed.id)
+        if container is None:
+            container = await create_container(node, userhash)
+            path = 'cold'
+
+    view = ContainerView(container)
+    with core.METRICS.timed('address_lookup'):
+        address = core.container_address(node.core, view)
+    if core.SESSION_CACHE_ENABLED:
+        core.SESSION_CACHE.put(userhash, node.core, view, cache_token)
+    result = {"session_url": core.session_url(core.session_token(userhash, view.id), address), "container_name": container_name}
+    return result, view.id, node.name, path
+
+
+async def start_user_session(userhash):
+    container_name = f"rootblood_session_{userhash}"
+    started = time.monotonic()
+
+    cached = core.SESSION_CACHE.get(userhash) if core.SESSION_CACHE_ENABLED else None
+    if cached is not None and cached['status'] == 'running':
+        core.WARM_POOL.record_time_to_url('existing', time.monotonic() - started)
+        result = {"session_url": core.session_url(core.session_token(userhash, cached['container_id']), cached['address']),
+                  "container_name": container_name}
+        return result, cached['container_id'], cached['node']
+
+    with core.METRICS.timed('single_flight'):
+        result, container_id, node_name, path = await ASYNC_FLIGHTS.do(userhash, lambda: find_or_create_container(userhash))
+    core.WARM_POOL.record_time_to_url(path, time.monotonic() - started)
+    return result, container_id, node_name
+
+
+async def resolve_identity(username, userhash):
+    identity = core.IDENTITY_CACHE.get(username)
+    if identity is not None:
+        return identity
+
+    # Claimed before the transaction, so the SQLite write lock isn't held across the filesystem calls.
+    with core.METRICS.timed('claim_directory'):
+        project_dir = await asyncio.to_thread(core.ClaimDirectory(userhash).claim_directory)
+
+    started = time.monotonic()
+    statement = BACKEND.insert(core.User).values(username=username, userhash=userhash)
+    statement = statement.on_conflict_do_update(
+        index_elements=['username'], set_={'userhash': statement.excluded.userhash}
+    ).returning(core.User.id)
+    try:
+        async with BACKEND.engine.begin() as conn:
+            with core.METRICS.timed('identity_upsert'):
+                user_id = (await conn.execute(statement)).scalar_one()
+            upsert_seconds = time.monotonic() - started
+            with core.METRICS.timed('project_insert'):
+                await conn.execute(BACKEND.insert(core.Project).values(path=project_dir, owner_id=user_id)
+                                   .on_conflict_do_nothing(index_elements=['path']))
+    except IntegrityError:
+        # A unique userhash held by another username, see resolve_identity in app.py.
+        async with BACKEND.engine.connect() as conn:
+            taken_by = (await conn.execute(select(core.User.username).where(core.User.userhash == userhash))).scalar_one_or_none()
+        log.error(f"Userhash {userhash} of {username} already belongs to {taken_by}")
+        raise core.UserhashTaken(username)
+
+    identity = {"user_id": user_id, "userhash": userhash, "project_path": project_dir, "container_id": None}
+    core.IDENTITY_CACHE.put(username, identity, upsert_seconds)
+    return identity
+
+
+async def track_session(container_id, container_name, user_id, node_name):
+    table = core.ActiveSession.__table__
+    now = datetime.now(timezone.utc)
+    async with BACKEND.engine.begin() as conn:
+        updated = await conn.execute(update(table).where(table.c.container_name == container_name)
+                                     .values(container_id=container_id, node=node_name, last_active=now))
+        if updated.rowcount == 0:
+            await conn.execute(insert(table).values(container_id=container_id, container_name=container_name,
+                                                    user_id=user_id, node=node_name, last_active=now))
+    core.IDLE_REAPER.touch(container_name, now)
+
+
+async def provision_session(username, userhash):
+    with core.METRICS.timed('total'):
+        identity = await resolve_identity(username, userhash)
+        result, container_id, node_name = await start_user_session(userhash)
+        if identity['container_id'] == container_id:
+            core.HEARTBEATS.record(result['container_name'])
+        else:
+            with core.METRICS.timed('track_session'):
+                await track_session(container_id, result['container_name'], identity['user_id'], node_name)
+            identity['container_id'] = container_id
+    return result
+
+
+class AsyncProvisioningJobs:
+    """job id -> outcome for the 202 flow of /session, every job a task on the API's loop.
+
+    Jobs are ProvisioningJob rows as well, shared with app.py's workers and any other API process.
+    """
+
+    def __init__(self, queue_limit):
+        self.queue_limit = queue_limit
+        self.jobs = {}
+        self.tasks = set()
+
+    def pending(self):
+        return sum(1 for job in self.jobs.values() if job['status'] == 'pending')
+
+    def prune(self):
+        cutoff = time.monotonic() - core.PROVISIONING_JOB_TTL_SECONDS
+        for job_id in [job_id for job_id, job in self.jobs.items() if job['status'] != 'pending' and job['finished'] < cutoff]:
+            del self.jobs[job_id]
+
+    async def submit(self, username, userhash):
+        self.prune()
+        if self.pending() >= self.queue_limit:
+            return None
+        job_id = uuid.uuid4().hex
+        self.jobs[job_id] = {"status": "pending", "result": None, "error": None,
+                             "finished": None, "done": asyncio.Event()}
+        table = core.ProvisioningJob.__table__
+        try:
+            async with BACKEND.engine.begin() as conn:
+                await conn.execute(insert(table).values(id=job_id, status='pending', created_at=datetime.now(timezone.utc)))
+        except Exception:
+            del self.jobs[job_id]
+            raise
+        # The loop only keeps weak references to tasks.
+        task = asyncio.ensure_future(self.run(job_id, username, userhash))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return job_id
+
+    async def run(self, job_id, username, userhash):
+        try:
+            outcome = {"status": "ready", "result": await provision_session(username, userhash)}
+        except core.HostFull as e:
+            outcome = {"status": "rejected", "error": str(e), "retry_after": e.retry_after}
+        except core.UserhashTaken as e:
+            outcome = {"status": "conflict", "error": str(e)}
+        except Exception as e:
+            log.error(f"Provisioning job {job_id} for {userhash} failed: {e}")
+            outcome = {"status": "failed", "error": str(e)}
+
+        table = core.ProvisioningJob.__table__
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=core.PROVISIONING_JOB_TTL_SECONDS)
+        try:
+            async with BACKEND.engine.begin() as conn:
+                await conn.execute(update(table).where(table.c.id == job_id).values(**outcome))
+                await conn.execute(delete(table).where(table.c.created_at < cutoff))
+        except Exception as e:
+            log.error(f"Could not record provisioning job {job_id}: {e}")
+
+        job = self.jobs[job_id]
+        job.update(outcome)
+        job['finished'] = time.monotonic()
+        job['done'].set()
+
+    async def load(self, job_id):
+        table = core.ProvisioningJob.__table__
+        async with BACKEND.engine.connect() as conn:
+            row = (await conn.execute(select(table).where(table.c.id == job_id))).mappings().first()
+        return dict(row) if row is not None else None
+
+    async def wait(self, job_id, timeout):
+        job = self.jobs.get(job_id)
+        if job is not None:
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(job['done'].wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return job
+
+        # Submitted through another process.
+        deadline = time.monotonic() + timeout
+        job = await self.load(job_id)
+        while job is not None and job['status'] == 'pending' and time.monotonic() < deadline:
+            await asyncio.sleep(min(core.PROVISIONING_JOB_POLL_SECONDS, max(0, deadline - time.monotonic())))
+            job = await self.load(job_id)
+        return job
+
+    def stats(self):
+        return {"jobs": len(self.jobs), "pending": self.pending(), "tasks": len(self.tasks)}
+
+
+ASYNC_JOBS = AsyncProvisioningJobs(ASYNC_PROVISIONING_QUEUE_LIMIT)
+
+#---------------------------------------------
+# Routes
+#---------------------------------------------
+
+async def read_json(request):
+    # Flask's request.get_json() or {}.
+    if not request.can_read_body:
+        return {}
+    try:
+        return await request.json() or {}
+    except ValueError:
+        raise web.HTTPBadRequest(text='{"error": "Invalid JSON body"}', content_type='application/json')
+
+
+async def status(request):
+    return web.json_response({"status": "ok"})
+
+
+async def create_session(request):
+    log.info("Running the session endpoint")
+    data = await read_json(request)
+    if data.get('guest'):
+        if not core.GUEST_SESSIONS_ENABLED or core.GUEST_POOL.node is None:
+            return web.json_response({"error": "Guest sessions are disabled"}, status=404)
+        # A claim is one inspect of an already running container, the pool itself stays on app.py's reaper thread.
+        with core.METRICS.timed('guest_claim'):
+            result = await asyncio.to_thread(core.GUEST_POOL.claim)
+        if result is None:
+            return web.json_response({"error": "No guest session available, try again shortly"},
+                                     status=503, headers={"Retry-After": str(core.GUEST_RETRY_AFTER_SECONDS)})
+        return web.json_response(result)
+
+    username = data.get('username')
+    if not username:
+        return web.json_response({"Error": "Username is rewuired.."}, status=400)
+
+    userhash = core.make_userhash(username)
+
+    quota = core.USAGE_INDEX.check_quota(userhash)
+    notice = {}
+    if quota == 'hard':
+        notice = {"warning": "Disk quota exceeded, writes fail until some space is freed",
+                  "usage": core.USAGE_INDEX.usage(userhash)}
+    elif quota == 'soft':
+        notice = {"warning": "Disk usage is over the soft quota"}
+
+    if not data.get('async', core.SESSION_PROVISIONING_ASYNC):
+        try:
+            return web.json_response({**await provision_session(username, userhash), **notice})
+        except core.HostFull as e:
+            return web.json_response({"error": str(e)}, status=503, headers={"Retry-After": str(e.retry_after)})
+        except core.UserhashTaken as e:
+            return web.json_response({"error": str(e)}, status=409)
+
+    job_id = await ASYNC_JOBS.submit(username, userhash)
+    if job_id is None:
+        return web.json_response({"error": "Too many sessions being provisioned, try again shortly"},
+                                 status=503, headers={"Retry-After": "5"})
+
+    status_url = f"/session/{job_id}"
+    return web.json_response({"job_id": job_id, "status": "pending", "status_url": status_url, **notice},
+                             status=202, headers={"Location": status_url})
+
+
+async def session_job_status(request):
+    job_id = request.match_info['job_id']
+    try:
+        wait = min(float(request.query.get('wait', 0)), core.PROVISIONING_LONG_POLL_MAX_SECONDS)
+    except ValueError:
+        wait = 0
+    job = await ASYNC_JOBS.wait(job_id, wait)
+
+    if job is None:
+        return web.json_response({"error": "Unknown job id"}, status=404)
+    if job['status'] == 'pending':
+        return web.json_response({"job_id": job_id, "status": "pending"}, status=202)
+    if job['status'] == 'rejected':
+        return web.json_response({"job_id": job_id, "status": "rejected", "error": job['error']},
+                                 status=503, headers={"Retry-After": str(job['retry_after'])})
+    if job['status'] == 'conflict':
+        return web.json_response({"job_id": job_id, "status": "conflict", "error": job['error']}, status=409)
+    if job['status'] == 'failed':
+        return web.json_response({"job_id": job_id, "status": "failed", "error": job['error']}, status=500)
+    return web.json_response({"job_id": job_id, "status": "ready", **job['result']})
+
+
+async def session_heartbeat(request):
+    data = await read_json(request)
+    container_name = data.get('container_name')
+    if not container_name:
+        return web.json_response({"error": "Container name is required"}, status=400)
+    if not core.is_session_container(container_name):
+        return web.json_response({"error": "Unknown session"}, status=404)
+
+    core.HEARTBEATS.record(container_name)
+    return web.json_response({"message": "Heartbeat received"}, status=202)
+
+
+def make_app(docker_client=default_docker_client):
+    api = web.Application()
+    api.router.add_get('/status', status)
+    api.router.add_post('/session', create_session)
+    api.router.add_post('/session/heartbeat', session_heartbeat)
+    api.router.add_get('/session/{job_id}', session_job_status)
+
+    async def start_backend(api):
+        await BACKEND.start(docker_client)
+
+    async def close_backend(api):
+        await BACKEND.close()
+
+    api.on_startup.append(start_backend)
+    api.on_cleanup.append(close_backend)
+    return api
+
+
+if __name__ == '__main__':
+    core.start_services()
+    web.run_app(make_app(), host=ASYNC_API_HOST, port=ASYNC_API_PORT)
@@ -0,0 +1,524 @@
+"""In-process stand-in for the parts of the docker SDK the orchestrator uses.
+
+Every daemon call sleeps for its injected latency (mean * scale, +/- jitter) and can be capped to a number of
+calls in flight, like a busy dockerd. Containers, volumes and networks live in dicts and state changes are
+published to every events() stream, so the session cache and admission books see them as they would for real.
+FakeAioDocker puts the aiodocker surface async_app.py uses over the same daemon.
+"""
+
+import asyncio
+import itertools
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import aiodocker
+import docker
+
+# Seconds per call, roughly what a local dockerd on an SSD answers with.
+DEFAULT_LATENCIES = {
+    'containers.get': 0.003,
+    'containers.list': 0.01,
+    'containers.run': 0.6,
+    'containers.create': 0.15,
+    'container.start': 0.35,
+    'container.stop': 0.25,
+    'container.pause': 0.03,
+    'container.unpause': 0.03,
+    'container.remove': 0.1,
+    'container.rename': 0.01,
+    'container.reload': 0.003,
+    'container.exec_run': 0.05,
+    'volumes.get': 0.002,
+    'volumes.list': 0.01,
+    'volumes.create': 0.02,
+    'volume.remove': 0.02,
+    'networks.list': 0.005,
+    'networks.create': 0.05,
+}
+
+# operation -> (HTTP method, path) the real SDK would send, handed to the api response hooks.
+ENDPOINTS = {
+    'containers.get': ('GET', '/containers/{id}/json'),
+    'containers.list': ('GET', '/containers/json'),
+    'containers.run': ('POST', '/containers/create'),
+    'containers.create': ('POST', '/containers/create'),
+    'container.start': ('POST', '/containers/{id}/start'),
+    'container.stop': ('POST', '/containers/{id}/stop'),
+    'container.pause': ('POST', '/containers/{id}/pause'),
+    'container.unpause': ('POST', '/containers/{id}/unpause'),
+    'container.remove': ('DELETE', '/containers/{id}'),
+    'container.rename': ('POST', '/containers/{id}/rename'),
+    'container.reload': ('GET', '/containers/{id}/json'),
+    'container.exec_run': ('POST', '/containers/{id}/exec'),
+    'volumes.get': ('GET', '/volumes/{id}'),
+    'volumes.list': ('GET', '/volumes'),
+    'volumes.create': ('POST', '/volumes/create'),
+    'volume.remove': ('DELETE', '/volumes/{id}'),
+    'networks.list': ('GET', '/networks'),
+    'networks.create': ('POST', '/networks/create'),
+}
+
+
+class FakeDaemon:
+    """Shared state and call accounting behind a FakeDockerClient."""
+
+    def __init__(self, latencies=None, scale=1.0, jitter=0.25, parallelism=None, seed=None):
+        self.latencies = {**DEFAULT_LATENCIES, **(latencies or {})}
+        self.scale = scale
+        self.jitter = jitter
+        self.slots = threading.BoundedSemaphore(parallelism) if parallelism else None
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.containers = {}
+        self.volumes = {}
+        self.networks = {}
+        self.subscribers = []
+        self.calls = Counter()
+        self.call_seconds = Counter()
+        self.hooks = {'response': []}
+        self.ips = itertools.count(2)
+        self.host_ports = itertools.count(32768)
+
+    def delay(self, operation):
+        with self.lock:
+            delay = self.latencies.get(operation, 0) * self.scale * self.random.uniform(1 - self.jitter, 1 + self.jitter)
+            self.call_seconds[operation] += delay
+        return delay
+
+    def record(self, operation, resource_id='', status=200):
+        # Accounting only, the async facade does its waiting on the event loop before calling in.
+        with self.lock:
+            self.calls[operation] += 1
+        method, path = ENDPOINTS.get(operation, ('GET', '/' + operation))
+        response = SimpleNamespace(status_code=status, request=SimpleNamespace(
+            method=method, path_url='/v1.43' + path.replace('{id}', resource_id or 'none')))
+        for hook in list(self.hooks['response']):
+            hook(response)
+
+    def call(self, operation, resource_id='', status=200):
+        delay = self.delay(operation)
+        if self.slots is None:
+            time.sleep(delay)
+        else:
+            with self.slots:
+                time.sleep(delay)
+        self.record(operation, resource_id, status)
+
+    def publish(self, record, action, **attributes):
+        event = {
+            'Type': 'container',
+            'Action': action,
+            'Actor': {'ID': record['id'], 'Attributes': {'name': record['name'], **record['labels'], **attributes}},
+            'time': int(time.time()),
+        }
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+    def find_container(self, name_or_id):
+        with self.lock:
+            record = self.containers.get(name_or_id)
+            if record is None:
+                record = next((r for r in self.containers.values()
+                               if r['id'] == name_or_id or r['id'].startswith(name_or_id)), None)
+            return record
+
+    def stats(self):
+        with self.lock:
+            return {
+                "containers": Counter(record['status'] for record in self.containers.values()),
+                "volumes": len(self.volumes),
+                "calls": dict(self.calls),
+                "call_seconds": {operation: round(seconds, 3) for operation, seconds in self.call_seconds.items()},
+            }
+
+
+class FakeContainer:
+    """What containers.get hands back, a snapshot of the daemon's record until reload()."""
+
+    def __init__(self, daemon, record, call=None):
+        self.daemon = daemon
+        self.record = record
+        self.call = call or daemon.call
+        self.attrs = self.snapshot()
+
+    def snapshot(self):
+        record = self.record
+        networks = {name: {'IPAddress': ip} for name, ip in record['networks'].items()}
+        ports = {}
+        if record['status'] == 'running':
+            ports = {port: [{'HostIp': '0.0.0.0', 'HostPort': str(host_port)}] for port, host_port in record['ports'].items()}
+        return {
+            'Id': record['id'],
+            'Name': '/' + record['name'],
+            'State': {'Status': record['status'], 'Running': record['status'] == 'running'},
+            'Config': {'Image': record['image'], 'Labels': dict(record['labels'])},
+            'HostConfig': {'NanoCpus': record['nano_cpus'], 'Memory': record['mem_limit']},
+            'Mounts': [dict(mount) for mount in record.get('mounts', [])],
+            'NetworkSettings': {'Networks': networks, 'Ports': ports},
+        }
+
+    @property
+    def id(self):
+        return self.record['id']
+
+    @property
+    def short_id(self):
+        return self.record['id'][:12]
+
+    @property
+    def name(self):
+        return self.attrs['Name'].lstrip('/')
+
+    @property
+    def status(self):
+        return self.attrs['State']['Status']
+
+    @property
+    def labels(self):
+        return self.attrs['Config']['Labels']
+
+    @property
+    def ports(self):
+        return self.attrs['NetworkSettings']['Ports']
+
+    def check_exists(self):
+        # A handle outliving its container gets a 404 from the daemon, same as real docker.
+        if self.daemon.containers.get(self.record['name']) is not self.record:
+            raise docker.errors.NotFound(f"No such container: {self.id}")
+
+    def reload(self):
+        self.call('container.reload', self.id)
+        with self.daemon.lock:
+            self.check_exists()
+            self.attrs = self.snapshot()
+
+    def transition(self, operation, allowed, status, action):
+        self.call(operation, self.id)
+        with self.daemon.lock:
+            self.check_exists()
+            if self.record['status'] not in allowed:
+                raise docker.errors.APIError(f"Container {self.name} is {self.record['status']}, cannot {action}")
+            self.record['status'] = status
+        self.daemon.publish(self.record, action)
+
+    def start(self):
+        if self.record['status'] != 'running':
+            self.transition('container.start', ('created', 'exited'), 'running', 'start')
+            return
+        self.call('container.start', self.id, status=304)
+        with self.daemon.lock:
+            self.check_exists()
+
+    def stop(self, timeout=10):
+        if self.record['status'] in ('running', 'paused'):
+            self.transition('container.stop', ('running', 'paused'), 'exited', 'stop')
+            self.daemon.publish(self.record, 'die')
+            return
+        self.call('container.stop', self.id, status=304)
+        with self.daemon.lock:
+            self.check_exists()
+
+    def pause(self):
+        self.transition('container.pause', ('running',), 'paused', 'pause')
+
+    def unpause(self):
+        self.transition('container.unpause', ('paused',), 'running', 'unpause')
+
+    def rename(self, name):
+        self.call('container.rename', self.id)
+        with self.daemon.lock:
+            self.check_exists()
+            if name in self.daemon.containers:
+                raise docker.errors.APIError(f"Conflict. The container name \"/{name}\" is already in use")
+            old_name = self.record['name']
+            self.daemon.containers[name] = self.daemon.containers.pop(old_name)
+            self.record['name'] = name
+        self.daemon.publish(self.record, 'rename', oldName='/' + old_name)
+
+    def remove(self, force=False, v=False):
+        self.call('container.remove', self.id)
+        with self.daemon.lock:
+            if self.record['status'] in ('running', 'paused') and not force:
+                raise docker.errors.APIError(f"Container {self.name} is {self.record['status']}, stop it or force the removal")
+            self.check_exists()
+            del self.daemon.containers[self.record['name']]
+            was_running = self.record['status'] in ('running', 'paused')
+            self.record['status'] = 'removing'
+        if was_running:
+            self.daemon.publish(self.record, 'die')
+        self.daemon.publish(self.record, 'destroy')
+
+    def exec_run(self, cmd, **kwargs):
+        self.call('container.exec_run', self.id)
+        return 0, b''
+
+
+class FakeContainers:
+    def __init__(self, daemon, call=None):
+        self.daemon = daemon
+        self.call = call or daemon.call
+
+    def get(self, name_or_id):
+        record = self.daemon.find_container(name_or_id)
+        if record is None:
+            self.call('containers.get', name_or_id, status=404)
+            raise docker.errors.NotFound(f"No such container: {name_or_id}")
+        self.call('containers.get', record['id'])
+        return FakeContainer(self.daemon, record, self.call)
+
+    def create(self, image, command=None, name=None, volumes=None, labels=None, network=None, ports=None,
+               mem_limit=None, nano_cpus=None, **kwargs):
+        return self.make('containers.create', image, name, volumes, labels, network, ports, mem_limit, nano_cpus, 'created')
+
+    def run(self, image, command=None, detach=False, name=None, volumes=None, labels=None, network=None, ports=None,
+            mem_limit=None, nano_cpus=None, **kwargs):
+        return self.make('containers.run', image, name, volumes, labels, network, ports, mem_limit, nano_cpus, 'running')
+
+    def make(self, operation, image, name, volumes, labels, network, ports, mem_limit, nano_cpus, status):
+        container_id = uuid.uuid4().hex + uuid.uuid4().hex
+        name = name or f"fake_{container_id[:12]}"
+        self.call(operation, container_id)
+        with self.daemon.lock:
+            if name in self.daemon.containers:
+                raise docker.errors.APIError(f"Conflict. The container name \"/{name}\" is already in use")
+            ip = next(self.daemon.ips)
+            # Named volumes that don't exist yet are created on the fly, as docker does.
+            for source in (volumes or {}):
+                if not source.startswith('/') and source not in self.daemon.volumes:
+                    self.daemon.volumes[source] = FakeVolumes.record(source, 'local', {}, {})
+            record = {
+                'id': container_id,
+                'name': name,
+                'image': image,
+                'status': status,
+                'labels': dict(labels or {}),
+                'networks': {network: f"172.30.{ip // 250}.{ip % 250 + 2}"} if network else {},
+                'ports': {port: next(self.daemon.host_ports) for port in (ports or {})},
+                'mem_limit': mem_limit or 0,
+                'nano_cpus': nano_cpus or 0,
+                'mounts': [{'Source': source, 'Destination': spec.get('bind'), 'RW': spec.get('mode', 'rw') == 'rw'}
+                           for source, spec in (volumes or {}).items()],
+            }
+            self.daemon.containers[name] = record
+        self.daemon.publish(record, 'create')
+        if status == 'running':
+            self.daemon.publish(record, 'start')
+        return FakeContainer(self.daemon, record, self.call)
+
+    def list(self, all=False, filters=None):
+        self.call('containers.list')
+        filters = filters or {}
+        with self.daemon.lock:
+            records = list(self.daemon.containers.values())
+        matched = []
+        for record in records:
+            if not all and record['status'] != 'running':
+                continue
+            if 'name' in filters and filters['name'] not in record['name']:
+                continue
+            if 'label' in filters:
+                key, _, value = filters['label'].partition('=')
+                if key not in record['labels'] or (value and record['labels'][key] != value):
+                    continue
+            matched.append(FakeContainer(self.daemon, record, self.call))
+        return matched
+
+
+class FakeVolume:
+    def __init__(self, daemon, record):
+        self.daemon = daemon
+        self.name = record['Name']
+        self.attrs = dict(record)
+
+    def remove(self, force=False):
+        self.daemon.call('volume.remove', self.name)
+        with self.daemon.lock:
+            self.daemon.volumes.pop(self.name, None)
+
+
+class FakeVolumes:
+    def __init__(self, daemon):
+        self.daemon = daemon
+
+    @staticmethod
+    def record(name, driver, driver_opts, labels):
+        return {'Name': name, 'Driver': driver, 'Options': dict(driver_opts or {}), 'Labels': dict(labels or {}),
+                'Mountpoint': f"/var/lib/docker/volumes/{name}/_data"}
+
+    def get(self, name):
+        with self.daemon.lock:
+            record = self.daemon.volumes.get(name)
+        if record is None:
+            self.daemon.call('volumes.get', name, status=404)
+            raise docker.errors.NotFound(f"No such volume: {name}")
+        self.daemon.call('volumes.get', name)
+        return FakeVolume(self.daemon, record)
+
+    def create(self, name=None, driver='local', driver_opts=None, labels=None):
+        name = name or uuid.uuid4().hex
+        self.daemon.call('volumes.create', name)
+        with self.daemon.lock:
+            record = self.daemon.volumes.setdefault(name, self.record(name, driver, driver_opts, labels))
+        return FakeVolume(self.daemon, record)
+
+    def list(self, filters=None):
+        self.daemon.call('volumes.list')
+        prefix = (filters or {}).get('name', '')
+        with self.daemon.lock:
+            return [FakeVolume(self.daemon, record) for name, record in self.daemon.volumes.items() if prefix in name]
+
+
+class FakeNetworks:
+    def __init__(self, daemon):
+        self.daemon = daemon
+
+    def list(self, names=None):
+        self.daemon.call('networks.list')
+        with self.daemon.lock:
+            return [SimpleNamespace(name=name, attrs=attrs) for name, attrs in self.daemon.networks.items()
+                    if names is None or name in names]
+
+    def create(self, name, driver='bridge', **kwargs):
+        self.daemon.call('networks.create', name)
+        with self.daemon.lock:
+            self.daemon.networks[name] = {'Name': name, 'Driver': driver, 'Options': kwargs.get('options') or {}}
+        return SimpleNamespace(name=name, attrs=self.daemon.networks[name])
+
+
+class FakeDockerClient:
+    """Drop-in for docker.DockerClient, several clients on one FakeDaemon are several connections to one node."""
+
+    def __init__(self, daemon):
+        self.daemon = daemon
+        self.containers = FakeContainers(daemon)
+        self.volumes = FakeVolumes(daemon)
+        self.networks = FakeNetworks(daemon)
+        self.api = SimpleNamespace(hooks=daemon.hooks)
+
+    def events(self, decode=False, filters=None):
+        subscriber = queue.Queue()
+        with self.daemon.lock:
+            self.daemon.subscribers.append(subscriber)
+
+        def stream():
+            while True:
+                yield subscriber.get()
+        return stream()
+
+    def ping(self):
+        return True
+
+    def close(self):
+        pass
+
+
+@contextmanager
+def aiodocker_errors():
+    # aiodocker has a single error type carrying the HTTP status.
+    try:
+        yield
+    except docker.errors.NotFound as e:
+        raise aiodocker.DockerError(404, str(e))
+    except docker.errors.APIError as e:
+        raise aiodocker.DockerError(409, str(e))
+
+
+class FakeAioContainer:
+    """aiodocker's DockerContainer over the same daemon records."""
+
+    def __init__(self, client, container):
+        self.client = client
+        self.container = container
+
+    @property
+    def id(self):
+        return self.container.id
+
+    def __getitem__(self, key):
+        return self.container.attrs[key]
+
+    async def show(self):
+        await self.client.wait('container.reload')
+        with aiodocker_errors():
+            self.container.reload()
+        return self.container.attrs
+
+    async def start(self):
+        await self.client.wait('container.start')
+        with aiodocker_errors():
+            self.container.start()
+
+    async def stop(self, t=None):
+        await self.client.wait('container.stop')
+        with aiodocker_errors():
+            self.container.stop()
+
+    async def pause(self):
+        await self.client.wait('container.pause')
+        with aiodocker_errors():
+            self.container.pause()
+
+    async def unpause(self):
+        await self.client.wait('container.unpause')
+        with aiodocker_errors():
+            self.container.unpause()
+
+    async def delete(self, force=False):
+        await self.client.wait('container.remove')
+        with aiodocker_errors():
+            self.container.remove(force=force)
+
+
+class FakeAioContainers:
+    def __init__(self, client):
+        self.client = client
+        self.containers = FakeContainers(client.daemon, client.daemon.record)
+
+    async def get(self, container_id):
+        await self.client.wait('containers.get')
+        with aiodocker_errors():
+            return FakeAioContainer(self.client, self.containers.get(container_id))
+
+    async def run(self, config, *, name=None):
+        # The raw API body async_app sends, back into the docker-py style arguments of FakeContainers.
+        host_config = config.get('HostConfig', {})
+        network = host_config.get('NetworkMode')
+        await self.client.wait('containers.run')
+        with aiodocker_errors():
+            container = self.containers.run(
+                config['Image'], name=name,
+                volumes={source: {'bind': target, 'mode': mode}
+                         for source, target, mode in (bind.split(':') for bind in host_config.get('Binds', []))},
+                labels=config.get('Labels'),
+                network=network if network not in (None, 'default', 'bridge') else None,
+                ports=dict.fromkeys(config.get('ExposedPorts', {})),
+                mem_limit=host_config.get('Memory'), nano_cpus=host_config.get('NanoCpus'))
+        return FakeAioContainer(self.client, container)
+
+
+class FakeAioDocker:
+    """Drop-in for aiodocker.Docker on a FakeDaemon, latencies are slept on the event loop."""
+
+    def __init__(self, daemon, parallelism=None):
+        self.daemon = daemon
+        self.slots = asyncio.Semaphore(parallelism) if parallelism else None
+        self.containers = FakeAioContainers(self)
+
+    async def wait(self, operation):
+        delay = self.daemon.delay(operation)
+        if self.slots is None:
+            await asyncio.sleep(delay)
+        else:
+            async with self.slots:
+                await asyncio.sleep(delay)
+
+    async def close(self):
+        pass
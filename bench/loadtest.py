@@ -0,0 +1,464 @@
+"""Load driver for the orchestrator against the fake docker daemon in fake_docker.py.
+
+N simulated users each go through --rounds of: POST /session (and the long-poll until it is ready),
+--heartbeats heartbeats --heartbeat-interval apart, then --idle-seconds of silence. Everything runs in this
+process, app.py through Flask's test client or async_app.py (--api async) through a loopback server,
+with its own database and playground under a scratch directory.
+
+    python bench/loadtest.py --users 200 --concurrency 50 --output baseline.json
+    python bench/loadtest.py --users 200 --concurrency 50 --baseline baseline.json
+    python bench/loadtest.py --api async --users 200 --concurrency 50 --baseline baseline.json
+
+The report has throughput, latency percentiles per request kind and per provisioning phase, docker calls
+and DB contention (statement latency per verb, lock errors, peak pooled connections).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import docker
+from aiohttp.test_utils import TestServer
+from sqlalchemy import event
+
+from fake_docker import DEFAULT_LATENCIES, FakeAioDocker, FakeDaemon, FakeDockerClient
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Percentiles in the report, and the ones a --baseline comparison looks at.
+PERCENTILES = (50, 90, 95, 99)
+
+
+class Recorder:
+    """Latency samples per operation and outcome counters, shared by all simulated users."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.outcomes = {}
+
+    def observe(self, operation, seconds):
+        with self.lock:
+            self.samples.setdefault(operation, []).append(seconds)
+
+    def count(self, outcome):
+        with self.lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def timed(self, operation, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.observe(operation, time.perf_counter() - started)
+
+
+class DBContention:
+    """Statement latency per verb, lock errors and pooled connections in use, from engine events.
+
+    With SQLite a writer waiting on the lock sits inside execute (busy_timeout), so contention shows up
+    as the tail of the INSERT/UPDATE/DELETE latencies before it ever turns into 'database is locked'.
+    """
+
+    def __init__(self, engine):
+        self.lock = threading.Lock()
+        self.statements = {}
+        self.lock_errors = 0
+        self.errors = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.watch(engine)
+
+    def watch(self, engine):
+        # Both engines with --api async, the blocking one still carries the heartbeat flusher and the reaper.
+        event.listen(engine, 'before_cursor_execute', self.before_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_execute)
+        event.listen(engine, 'handle_error', self.handle_error)
+        event.listen(engine.pool, 'checkout', self.checkout)
+        event.listen(engine.pool, 'checkin', self.checkin)
+
+    def before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('bench_started', []).append(time.perf_counter())
+
+    def after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['bench_started'].pop()
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        with self.lock:
+            self.statements.setdefault(verb, []).append(seconds)
+
+    def handle_error(self, context):
+        conn = context.connection
+        if conn is not None and conn.info.get('bench_started'):
+            conn.info['bench_started'].pop()
+        message = str(context.original_exception).lower()
+        with self.lock:
+            self.errors += 1
+            if 'locked' in message or 'busy' in message or 'deadlock' in message:
+                self.lock_errors += 1
+
+    def checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self.lock:
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+    def checkin(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.checked_out -= 1
+
+
+def summarize(samples, percentile):
+    if not samples:
+        return {"count": 0}
+    summary = {"count": len(samples), "mean_ms": round(sum(samples) / len(samples) * 1000, 2)}
+    for pct in PERCENTILES:
+        summary[f"p{pct}_ms"] = round(percentile(samples, pct) * 1000, 2)
+    summary["max_ms"] = round(max(samples) * 1000, 2)
+    return summary
+
+
+def parse_latencies(values):
+    latencies = {}
+    for value in values:
+        operation, _, seconds = value.partition('=')
+        if operation not in DEFAULT_LATENCIES:
+            raise SystemExit(f"Unknown docker operation '{operation}', one of: {', '.join(sorted(DEFAULT_LATENCIES))}")
+        latencies[operation] = float(seconds)
+    return latencies
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=100, help='simulated users')
+    parser.add_argument('--concurrency', type=int, default=20, help='users active at the same time')
+    parser.add_argument('--rounds', type=int, default=2, help='sessions per user, the later ones find the container again')
+    parser.add_argument('--heartbeats', type=int, default=5, help='heartbeats per session')
+    parser.add_argument('--heartbeat-interval', type=float, default=0.2, help='seconds between heartbeats')
+    parser.add_argument('--idle-seconds', type=float, default=0.5, help='silence after the heartbeats of a session')
+    parser.add_argument('--idle-after', type=float, default=None,
+                        help='run the idle reaper with pause/stop/remove tiers at 1x/2x/4x this many seconds')
+    parser.add_argument('--api', choices=('flask', 'async'), default='flask',
+                        help='drive app.py through the Flask test client or async_app.py over loopback HTTP')
+    parser.add_argument('--sync', action='store_true', help='provision inside POST /session instead of the 202 flow')
+    parser.add_argument('--workers', type=int, default=8, help='provisioning workers in the 202 flow (Flask only)')
+    parser.add_argument('--queue-limit', type=int, default=64, help='pending provisioning jobs before a 503')
+    parser.add_argument('--capacity', type=int, default=None,
+                        help='sessions the fake host admits at once (default: every user fits)')
+    parser.add_argument('--latency', action='append', default=[], metavar='OPERATION=SECONDS',
+                        help='override one injected docker latency, e.g. containers.run=1.2')
+    parser.add_argument('--latency-scale', type=float, default=1.0, help='multiply every injected latency')
+    parser.add_argument('--jitter', type=float, default=0.25, help='latencies vary by +/- this fraction')
+    parser.add_argument('--docker-parallelism', type=int, default=None, help='docker calls the fake daemon serves at once')
+    parser.add_argument('--no-session-cache', action='store_true', help='skip the event-driven session cache')
+    parser.add_argument('--database', default=None, help='SQLAlchemy URI, a SQLite file in the scratch directory by default')
+    parser.add_argument('--workdir', default=None, help='scratch directory (default: a new temporary one)')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the latency jitter')
+    parser.add_argument('--output', default=None, help='write the report as JSON to this file')
+    parser.add_argument('--baseline', default=None, help='JSON report of an earlier run to compare against')
+    return parser.parse_args(argv)
+
+
+def load_app(args, daemon):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='rootblood-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    # app.log and anything else relative lands in the scratch directory, not in the checkout.
+    os.chdir(workdir)
+    docker.from_env = lambda *a, **kwargs: FakeDockerClient(daemon)
+    docker.DockerClient = lambda *a, **kwargs: FakeDockerClient(daemon)
+    sys.path.insert(0, REPO_ROOT)
+    import app as rootblood
+
+    rootblood.BASE_PLAYGROUND_PATH = os.path.join(workdir, 'playground')
+    rootblood.SESSION_TOKEN_KEY_PATH = os.path.join(workdir, 'session_token.key')
+    os.makedirs(rootblood.BASE_PLAYGROUND_PATH, exist_ok=True)
+    # Everything that needs root or real mounts on this host is off, the session path itself is untouched.
+    rootblood.HOME_TEMPLATES_ENABLED = False
+    rootblood.WARM_POOL_ENABLED = False
+    # Cold storage stays on, with its archives in the scratch directory: every new container asks it first.
+    rootblood.COLD_STORAGE = rootblood.ColdStorage(os.path.join(workdir, 'cold'))
+    rootblood.GIT_OBJECT_CACHE_ENABLED = False
+    rootblood.USAGE_QUOTAS_ENABLED = False
+    rootblood.SESSION_CACHE_ENABLED = not args.no_session_cache
+    rootblood.SESSION_PROVISIONING_ASYNC = not args.sync
+    rootblood.PROVISIONING_JOBS = rootblood.ProvisioningJobs(args.workers, args.queue_limit)
+
+    if args.database and args.database.startswith('postgresql'):
+        rootblood.DATABASE_BACKEND = 'postgresql'
+    uri, engine_options = rootblood.database_options()
+    rootblood.app.config['SQLALCHEMY_DATABASE_URI'] = args.database or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    rootblood.app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+    # Registering the extension again disposes the engine made at import and builds one for the URI above.
+    rootblood.app.extensions.pop('sqlalchemy')
+    rootblood.db.init_app(rootblood.app)
+    with rootblood.app.app_context():
+        rootblood.db.create_all()
+        contention = DBContention(rootblood.db.engine)
+
+    capacity = args.capacity or args.users
+    for node in rootblood.SCHEDULER.nodes.values():
+        node.admission = rootblood.AdmissionController(capacity * rootblood.SESSION_NANO_CPUS / 1e9,
+                                                       capacity * rootblood.SESSION_MEM_LIMIT_BYTES)
+        rootblood.ensure_session_network(node)
+        threading.Thread(target=rootblood.run_event_subscriber, args=(node,), daemon=True).start()
+    threading.Thread(target=rootblood.HEARTBEATS.run_flusher, daemon=True).start()
+    if args.idle_after:
+        rootblood.IDLE_REAPER.tiers = (('pause', args.idle_after), ('stop', 2 * args.idle_after),
+                                       ('remove', 4 * args.idle_after))
+        rootblood.SESSION_ACTIVITY_CHECK_INTERVAL_SECONDS = 1
+        threading.Thread(target=rootblood.IDLE_REAPER.run_periodically, daemon=True).start()
+    return rootblood, contention, workdir
+
+
+def request_session(client, username, recorder):
+    # Time until the user has a URL, whichever flow /session answers with.
+    started = time.perf_counter()
+    response = recorder.timed('post_session', client.post, '/session', json={'username': username})
+    status_url = (response.json or {}).get('status_url')
+    while response.status_code == 202:
+        response = recorder.timed('poll_session', client.get, f"{status_url}?wait=10")
+    return session_outcome(recorder, started, response.status_code, response.json or {})
+
+
+def session_outcome(recorder, started, status_code, body):
+    if status_code == 200:
+        recorder.observe('time_to_url', time.perf_counter() - started)
+        recorder.count('ready')
+        return body.get('container_name')
+    recorder.count('rejected' if status_code == 503 else f"http_{status_code}")
+    return None
+
+
+def simulate_user(rootblood, index, args, recorder):
+    client = rootblood.app.test_client()
+    username = f"bench-user-{index}"
+    for _ in range(args.rounds):
+        container_name = request_session(client, username, recorder)
+        if container_name is None:
+            continue
+        for _ in range(args.heartbeats):
+            time.sleep(args.heartbeat_interval)
+            response = recorder.timed('heartbeat', client.post, '/session/heartbeat', json={'container_name': container_name})
+            if response.status_code != 202:
+                recorder.count(f"heartbeat_http_{response.status_code}")
+        time.sleep(args.idle_seconds)
+
+
+async def timed_request(client, recorder, operation, method, url, **kwargs):
+    started = time.perf_counter()
+    async with client.request(method, url, **kwargs) as response:
+        body = await response.json()
+    recorder.observe(operation, time.perf_counter() - started)
+    return response.status, body
+
+
+async def simulate_user_async(client, index, args, recorder):
+    # Same flow as simulate_user, as a coroutine against async_app.
+    username = f"bench-user-{index}"
+    for _ in range(args.rounds):
+        started = time.perf_counter()
+        status_code, body = await timed_request(client, recorder, 'post_session', 'POST', '/session', json={'username': username})
+        status_url = body.get('status_url')
+        while status_code == 202:
+            status_code, body = await timed_request(client, recorder, 'poll_session', 'GET', f"{status_url}?wait=10")
+        container_name = session_outcome(recorder, started, status_code, body)
+        if container_name is None:
+            continue
+        for _ in range(args.heartbeats):
+            await asyncio.sleep(args.heartbeat_interval)
+            status_code, _ = await timed_request(client, recorder, 'heartbeat', 'POST', '/session/heartbeat',
+                                                 json={'container_name': container_name})
+            if status_code != 202:
+                recorder.count(f"heartbeat_http_{status_code}")
+        await asyncio.sleep(args.idle_seconds)
+
+
+def drive_flask(rootblood, args, recorder):
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix='bench-user') as executor:
+        futures = [executor.submit(simulate_user, rootblood, index, args, recorder) for index in range(args.users)]
+        for future in futures:
+            future.result()
+
+
+def start_async_api(daemon, args):
+    # The API gets an event loop of its own on a thread, so the simulated users don't compete with it for one loop.
+    import async_app
+
+    async_app.ASYNC_JOBS = async_app.AsyncProvisioningJobs(args.queue_limit)
+    server = TestServer(async_app.make_app(lambda name, options: FakeAioDocker(daemon, args.docker_parallelism)))
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name='async-api', daemon=True).start()
+    asyncio.run_coroutine_threadsafe(server.start_server(), loop).result()
+    return async_app, server, loop
+
+
+async def drive_async(server, args, recorder):
+    # Unlike the Flask test client this goes through a real loopback HTTP server, which only costs the async side.
+    async with aiohttp.ClientSession(base_url=str(server.make_url('/')), connector=aiohttp.TCPConnector(limit=0)) as client:
+        slots = asyncio.Semaphore(args.concurrency)
+
+        async def user(index):
+            async with slots:
+                await simulate_user_async(client, index, args, recorder)
+        await asyncio.gather(*(user(index) for index in range(args.users)))
+
+
+class ProcessSampler:
+    """Peak thread count of the process while the load runs, sampled on its own thread."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_threads = threading.active_count()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+
+def phase_summary(rootblood):
+    # The phase histograms of /metrics only keep buckets, so this is count and mean per phase.
+    phases = {}
+    with rootblood.METRICS.lock:
+        for labels, histogram in rootblood.METRICS.histograms.get('rootblood_session_phase_seconds', {}).items():
+            phase = dict(labels)['phase']
+            phases[phase] = {"count": histogram['count'],
+                             "mean_ms": round(histogram['sum'] / histogram['count'] * 1000, 2) if histogram['count'] else None}
+    return dict(sorted(phases.items()))
+
+
+def run(args):
+    daemon = FakeDaemon(parse_latencies(args.latency), args.latency_scale, args.jitter, args.docker_parallelism, args.seed)
+    rootblood, contention, workdir = load_app(args, daemon)
+    recorder = Recorder()
+
+    flights = rootblood.SESSION_FLIGHTS
+    if args.api == 'async':
+        async_app, server, loop = start_async_api(daemon, args)
+        contention.watch(async_app.BACKEND.engine.sync_engine)
+        flights = async_app.ASYNC_FLIGHTS
+
+    started = time.perf_counter()
+    with ProcessSampler() as sampler:
+        if args.api == 'async':
+            asyncio.run(drive_async(server, args, recorder))
+        else:
+            drive_flask(rootblood, args, recorder)
+    duration = time.perf_counter() - started
+    rootblood.HEARTBEATS.flush()
+    if args.api == 'async':
+        asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+
+    percentile = rootblood.percentile
+    requests = sum(len(samples) for operation, samples in recorder.samples.items() if operation != 'time_to_url')
+    counters = rootblood.METRICS.counters.get('rootblood_db_transactions_total', {})
+    node = rootblood.SCHEDULER.local_node()
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        "workdir": workdir,
+        "duration_seconds": round(duration, 3),
+        "process": {
+            "peak_threads": sampler.peak_threads,
+            # ru_maxrss is in KiB on Linux.
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+        "throughput": {
+            "sessions_per_second": round(recorder.outcomes.get('ready', 0) / duration, 2),
+            "requests_per_second": round(requests / duration, 2),
+        },
+        "outcomes": dict(sorted(recorder.outcomes.items())),
+        "latency": {operation: summarize(samples, percentile) for operation, samples in sorted(recorder.samples.items())},
+        "phases": phase_summary(rootblood),
+        "db": {
+            "statements": {verb: summarize(samples, percentile) for verb, samples in sorted(contention.statements.items())},
+            "transactions": {dict(labels)['outcome']: count for labels, count in counters.items()},
+            "errors": contention.errors,
+            "lock_errors": contention.lock_errors,
+            "peak_connections": contention.peak_checked_out,
+        },
+        "docker": daemon.stats(),
+        "single_flight": flights.stats(),
+        "session_cache": rootblood.SESSION_CACHE.stats(),
+        "admission": node.admission.stats() if node else None,
+        "heartbeats": rootblood.HEARTBEATS.stats(),
+        "reaper": rootblood.IDLE_REAPER.stats(),
+    }
+
+
+def change(current, previous):
+    if current is None or not previous:
+        return ''
+    return f"{(current - previous) / previous * 100:+.1f}%"
+
+
+def print_report(report, baseline=None):
+    baseline = baseline or {}
+    base_latency = baseline.get('latency', {})
+    print(f"{report['config']['api']} API, {report['config']['users']} users x {report['config']['rounds']} rounds, "
+          f"concurrency {report['config']['concurrency']}, {report['duration_seconds']}s")
+    for key, value in report['throughput'].items():
+        print(f"  {key:<22} {value:>10} {change(value, baseline.get('throughput', {}).get(key))}")
+    print(f"  outcomes               {report['outcomes']}")
+    for key, value in report['process'].items():
+        print(f"  {key:<22} {value:>10} {change(value, baseline.get('process', {}).get(key))}")
+
+    print(f"\n  {'latency (ms)':<16} {'count':>7} {'mean':>9}" + ''.join(f" {f'p{pct}':>9}" for pct in PERCENTILES) + f" {'max':>9}")
+    rows = [(name, summary, base_latency.get(name, {})) for name, summary in report['latency'].items()]
+    rows += [(f"db {verb}", summary, baseline.get('db', {}).get('statements', {}).get(verb, {}))
+             for verb, summary in report['db']['statements'].items()]
+    for name, summary, previous in rows:
+        if not summary['count']:
+            continue
+        line = f"  {name:<16} {summary['count']:>7} {summary['mean_ms']:>9}"
+        line += ''.join(f" {summary[f'p{pct}_ms']:>9}" for pct in PERCENTILES) + f" {summary['max_ms']:>9}"
+        if previous.get('count'):
+            line += f"   p50 {change(summary['p50_ms'], previous['p50_ms'])}, p99 {change(summary['p99_ms'], previous['p99_ms'])}"
+        print(line)
+
+    print(f"\n  {'phase (ms)':<16} {'count':>7} {'mean':>9}")
+    for phase, summary in report['phases'].items():
+        previous = baseline.get('phases', {}).get(phase, {})
+        print(f"  {phase:<16} {summary['count']:>7} {summary['mean_ms']:>9} {change(summary['mean_ms'], previous.get('mean_ms'))}")
+
+    db = report['db']
+    print(f"\n  db transactions {db['transactions']}, errors {db['errors']} ({db['lock_errors']} lock), "
+          f"peak connections {db['peak_connections']}")
+    print(f"  docker calls {sum(report['docker']['calls'].values())}: {report['docker']['calls']}")
+    print(f"  single flight {report['single_flight']}, admission waited {report['admission']['queued']}, "
+          f"rejected {report['admission']['rejected']}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # The run changes into its scratch directory, paths given on the command line are relative to here.
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report = run(args)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()